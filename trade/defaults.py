@@ -1,9 +1,21 @@
 import json
+import os
 from abc import ABC
 from logging import getLogger, DEBUG
 from pathlib import Path
 from typing import Dict, Any
 
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+    _loads = orjson.loads
+except ImportError:
+    _dumps = json.dumps
+    _loads = json.loads
+
 logger = getLogger(__name__)
 logger.setLevel(DEBUG)
 
@@ -12,16 +24,25 @@ class Stateful(ABC):
 
     def __init__(self, path: str):
         self.path = Path(path)
+        self._abs = os.fspath(self.path.absolute())
+        self._tmp = self._abs + '.tmp'
+        self._last_saved = None
 
     def save_state(self) -> None:
-        logger.debug(f"Saving state to {str(self.path)}")
-        with open(str(self.path.absolute()), 'w+') as f:
-            json.dump(self.get_state(), f)
+        data = _dumps(self.get_state())
+        if data == self._last_saved:
+            return
+        logger.debug("Saving state to %s", self.path)
+        # Write next to the target and swap it in, so a crash mid-write never leaves a truncated state file
+        with open(self._tmp, 'w') as f:
+            f.write(data)
+        os.replace(self._tmp, self._abs)
+        self._last_saved = data
 
     def load_state(self) -> Dict[str, Any]:
-        logger.debug(f"Loading state from {str(self.path)}")
-        with open(str(self.path.absolute()), 'r+') as f:
-            state = json.load(f)
+        logger.debug("Loading state from %s", self.path)
+        with open(self._abs, 'r') as f:
+            state = _loads(f.read())
         return state
 
     def get_state(self) -> Dict[str, Any]:
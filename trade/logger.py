@@ -1,7 +1,9 @@
-from logging import Handler, getLevelName
+from logging import Handler, getLevelName, makeLogRecord
+from threading import Timer
+from typing import TYPE_CHECKING
 
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
+if TYPE_CHECKING:
+    from slack_sdk import WebClient
 
 
 class SlackHandler(Handler):
@@ -10,18 +12,28 @@ class SlackHandler(Handler):
     to a slack channel.
     """
 
-    def __init__(self, token: str, channel: str, username: str, fmt=None):
+    def __init__(self, client: 'WebClient', channel: str, username: str, fmt=None, batch_interval: float = 0.5):
         """
         Initialize the handler.
+
+        The client may be shared between handlers so they reuse one
+        connection pool.
+        Records emitted within `batch_interval` seconds of each other are
+        posted as a single message. A non-positive interval posts every
+        record immediately.
         """
         Handler.__init__(self)
         self.channel = channel
         self.username = username
-        self.client = WebClient(token=token)
+        self.client = client
+        self.batch_interval = batch_interval
+        self._buffer = []
+        self._timer = None
         if fmt:
             self.setFormatter(fmt)
 
     def _write(self, message: str):
+        from slack_sdk.errors import SlackApiError
         try:
             self.client.chat_postMessage(channel=self.channel, text=message)
         except SlackApiError as e:
@@ -29,27 +41,106 @@ class SlackHandler(Handler):
 
     def flush(self):
         """
-        Flushes the stream.
+        Posts any buffered messages to the Slack channel.
         """
         self.acquire()
-        self.release()
+        try:
+            messages, self._buffer = self._buffer, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        finally:
+            self.release()
+        if messages:
+            message = "\n".join(messages)
+            try:
+                self._write(message)
+            except RecursionError:  # See issue 36272
+                raise
+            except Exception:
+                # Runs on the batch timer thread, so report through the handler like a failed emit would
+                self.handleError(makeLogRecord(dict(msg=message)))
 
     def emit(self, record):
         """
         Emit a record.
 
         If a formatter is specified, it is used to format the record.
-        The record is then written to the Slack channel.
+        The record is then buffered and written to the Slack channel once
+        the batch interval elapses.
         """
         try:
             msg = self.format(record)
-            self._write(msg)
-            self.flush()
+            if self.batch_interval <= 0:
+                self._write(msg)
+                return
+            self._buffer.append(msg)
+            if self._timer is None:
+                self._timer = Timer(self.batch_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
         except RecursionError:  # See issue 36272
             raise
         except Exception:
             self.handleError(record)
 
+    def close(self):
+        """
+        Posts pending messages and closes the handler.
+        """
+        try:
+            self.flush()
+        finally:
+            Handler.close(self)
+
     def __repr__(self):
         level = getLevelName(self.level)
         return '<%s %s-%s(%s)>' % (self.__class__.__name__, self.channel, self.username, level)
+
+
+class FanoutHandler(Handler):
+    """
+    A handler class which passes each record on to every wrapped handler
+    whose level it meets.
+    """
+
+    def __init__(self, *handlers: Handler):
+        """
+        Initialize the handler.
+
+        The wrapped handlers are ordered by level so a record is only
+        checked against the handlers it can reach.
+        """
+        Handler.__init__(self)
+        self.handlers = sorted(handlers, key=lambda h: h.level)
+        if self.handlers:
+            self.setLevel(self.handlers[0].level)
+
+    def emit(self, record):
+        """
+        Emit a record.
+
+        The record is handed to the wrapped handlers in level order,
+        stopping at the first one above the record's level.
+        """
+        for h in self.handlers:
+            if record.levelno < h.level:
+                break
+            h.handle(record)
+
+    def flush(self):
+        """
+        Flushes the wrapped handlers.
+        """
+        for h in self.handlers:
+            h.flush()
+
+    def close(self):
+        """
+        Closes the wrapped handlers.
+        """
+        try:
+            for h in self.handlers:
+                h.close()
+        finally:
+            Handler.close(self)
@@ -1,3 +1,4 @@
+import os
 from logging import getLogger, DEBUG
 
 import numpy as np
@@ -7,58 +8,119 @@ from trade.defaults import Stateful
 logger = getLogger(__name__)
 logger.setLevel(DEBUG)
 
+_jitted = False
+
+
+def _lazy_jit():
+    # numba is only imported the first time a model is built, the kernels compile on their first call.
+    # The kernels are plain scalar arithmetic, so they still run (uncompiled) without numba.
+    global _kalman_step, _kalman_batch, _jitted
+    if _jitted:
+        return
+    try:
+        from numba import njit
+    except ImportError:
+        logger.debug("numba not available, running the Kalman kernels uncompiled")
+    else:
+        _kalman_step = njit(cache=True, fastmath=True)(_kalman_step)
+        _kalman_batch = njit(cache=True, fastmath=True)(_kalman_batch)
+    _jitted = True
+
+
+def _kalman_step(theta, R, C, w, nu, y1, y2):
+    # F = [[y1, 1]] is never materialised: every product with F is expanded into scalar arithmetic.
+    # R is the prior covariance, C is written with the posterior and R with the next prior (C + w).
+    r00, r01, r10, r11 = R[0, 0], R[0, 1], R[1, 0], R[1, 1]
+    et = y2 - (theta[0, 0] * y1 + theta[1, 0])
+    fr0 = r00 * y1 + r10
+    fr1 = r01 * y1 + r11
+    Qt = fr0 * y1 + fr1 + nu
+    a0 = (r00 * y1 + r01) / Qt
+    a1 = (r10 * y1 + r11) / Qt
+    theta[0, 0] += a0 * et
+    theta[1, 0] += a1 * et
+    C[0, 0] = r00 - a0 * fr0
+    C[0, 1] = r01 - a0 * fr1
+    C[1, 0] = r10 - a1 * fr0
+    C[1, 1] = r11 - a1 * fr1
+    R[0, 0] = C[0, 0] + w[0, 0]
+    R[0, 1] = C[0, 1] + w[0, 1]
+    R[1, 0] = C[1, 0] + w[1, 0]
+    R[1, 1] = C[1, 1] + w[1, 1]
+    return et, Qt, theta[0, 0]
+
+
+def _kalman_batch(theta, R, C, w, nu, ys1, ys2, out_e, out_q, out_b):
+    for i in range(ys1.size):
+        out_e[i], out_q[i], out_b[i] = _kalman_step(theta, R, C, w, nu, ys1[i], ys2[i])
+
 
 class KalmanOLS(Stateful):
 
     def __init__(self, path: str):
         super(KalmanOLS, self).__init__(path)
+        _lazy_jit()
+        # The matrices live in a fixed-size binary file next to the JSON state, which only holds the scalars
+        bin_path = self._abs + '.bin'
+        has_bin = os.path.exists(bin_path)
         try:
             state = self.load_state()
+        except FileNotFoundError:
+            state = None
+        if state is not None and not has_bin and "w" not in state:
+            raise FileNotFoundError(f"Model state {self.path} exists but its matrices file {bin_path} is missing")
+        self._mm = np.memmap(bin_path, dtype=np.float64, mode='r+' if has_bin else 'w+', shape=(14,))
+        buf = np.asarray(self._mm)
+        self.theta = buf[0:2].reshape(2, 1)
+        self.R = buf[2:6].reshape(2, 2)
+        self.C = buf[6:10].reshape(2, 2)
+        self.w = buf[10:14].reshape(2, 2)
+        if state is not None:
             self.delta = state["delta"]
             self.nu = state["nu"]
-            self.w = self._deserialize(state["w"])
-            self.theta = self._deserialize(state["theta"])
-            self.R = self._deserialize(state["R"])
-            self.C = self._deserialize(state["C"])
-        except FileNotFoundError:
+            # Older JSON states hold the matrices themselves and are migrated into the binary file
+            if not has_bin:
+                self._load_legacy_state(state)
+        else:
             logger.debug("Initialising state with defaults...")
             self.delta = 1e-4
             self.nu = 1e-3
-            self.w = self.delta / (1 - self.delta) * np.eye(2)
-            self.theta = np.zeros((2, 1))
-            self.R = np.random.rand(2, 2) / 100
-            self.C = None
+            self.w[...] = self.delta / (1 - self.delta) * np.eye(2)
+            self.theta[...] = 0
+            self.R[...] = np.random.rand(2, 2) / 100
+            # The step kernel keeps R as the prior for the next update, i.e. R == C + w
+            self.C[...] = self.R - self.w
+
+    def _load_legacy_state(self, state):
+        logger.debug("Migrating matrices from %s", self.path)
+        self.w[...] = state["w"]
+        self.theta[...] = state["theta"]
+        self.R[...] = state["R"]
+        if state["C"] is None:
+            self.C[...] = self.R - self.w
+        else:
+            self.C[...] = state["C"]
+            self.R[...] = self.C + self.w
+        self._mm.flush()
 
     def get_state(self):
         return {
             "delta": self.delta,
             "nu": self.nu,
-            "w": self._serialize(self.w),
-            "theta": self._serialize(self.theta),
-            "R": self._serialize(self.R),
-            "C": self._serialize(self.C),
         }
 
+    def save_state(self) -> None:
+        # The matrices are written through the memmap on every step, this only forces them to disk
+        self._mm.flush()
+        super(KalmanOLS, self).save_state()
+
     def __call__(self, y1: float, y2: float):
-        F = np.array([[y1, 1]])
-        self.R = self.R if self.C is None else self.C + self.w
-        yp = (F.dot(self.theta)).item()
-        et = y2 - yp
-        Qt = (F.dot(self.R).dot(F.T)).item() + self.nu
-        At = self.R.dot(F.T) / Qt
-        self.theta += At * et
-        self.C = self.R - At.dot(F).dot(self.R)
-
-        return et, Qt, self.theta[0, 0]
-
-    @staticmethod
-    def _serialize(x):
-        if isinstance(x, np.ndarray):
-            return x.tolist()
-        return x
-
-    @staticmethod
-    def _deserialize(x):
-        if isinstance(x, list):
-            return np.asarray(x)
-        return x
+        return _kalman_step(self.theta, self.R, self.C, self.w, self.nu, float(y1), float(y2))
+
+    def update_batch(self, ys1: np.ndarray, ys2: np.ndarray):
+        ys1 = np.ascontiguousarray(ys1, dtype=np.float64).ravel()
+        ys2 = np.ascontiguousarray(ys2, dtype=np.float64).ravel()
+        assert ys1.size == ys2.size, f"Batch sizes differ: {ys1.size} != {ys2.size}"
+        out_e, out_q, out_b = np.empty(ys1.size), np.empty(ys1.size), np.empty(ys1.size)
+        _kalman_batch(self.theta, self.R, self.C, self.w, self.nu, ys1, ys2, out_e, out_q, out_b)
+        return out_e, out_q, out_b
@@ -1,18 +1,19 @@
+import atexit
+import math
 import os
 import sys
 from argparse import ArgumentParser
 from enum import Enum
 from logging import getLogger, INFO, basicConfig, DEBUG, Formatter, CRITICAL, ERROR
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
 from signal import signal, SIGINT
 from time import sleep
 from typing import Dict, Any
 
-import numpy as np
-
 from trade.defaults import Stateful
-from trade.logger import SlackHandler
+from trade.logger import SlackHandler, FanoutHandler
 from trade.models import KalmanOLS
-from trade.private import SLACK_TOKEN
 from trade.traders import PairsTrader
 
 logging_format = '%(asctime)s  [%(name)s] (%(levelname)s): %(message)s'
@@ -20,10 +21,29 @@ basicConfig(filename='logs/pairs_logs', level=DEBUG, format=logging_format)
 logger = getLogger("statistical.arbitrage")
 formatter = Formatter(logging_format)
 
-for level in ("debug", "info", "error"):
-    sh = SlackHandler(username='logger', token=SLACK_TOKEN, channel=f'#{level}', fmt=formatter)
-    sh.setLevel(INFO if level == "info" else ERROR if level == "error" else CRITICAL if level == "critical" else DEBUG)
-    logger.addHandler(sh)
+
+def _install_slack_handlers(logger):
+    # Slack posts happen on the listener thread, the strategy loop only enqueues records
+    from slack_sdk import WebClient
+    from trade.private import SLACK_TOKEN
+
+    slack_client = WebClient(token=SLACK_TOKEN, timeout=2)
+    slack_handlers = []
+    for level in ("debug", "info", "error"):
+        sh = SlackHandler(username='logger', client=slack_client, channel=f'#{level}', fmt=formatter)
+        sh.setLevel(
+            INFO if level == "info" else ERROR if level == "error" else CRITICAL if level == "critical" else DEBUG
+        )
+        slack_handlers.append(sh)
+    slack_fanout = FanoutHandler(*slack_handlers)
+    slack_queue = Queue(-1)
+    slack_queue_handler = QueueHandler(slack_queue)
+    slack_queue_handler.setLevel(slack_fanout.level)
+    logger.addHandler(slack_queue_handler)
+    slack_listener = QueueListener(slack_queue, slack_fanout, respect_handler_level=True)
+    slack_listener.start()
+    atexit.register(slack_listener.stop)
+    return slack_listener
 
 
 def signal_handler(sig, frame):
@@ -40,7 +60,7 @@ class Position(str, Enum):
 class Pairs(Stateful):
 
     def __init__(self, pair_a: str, pair_b: str, path: str, bake_count: int, volume: float, th: float, sleep_time: int,
-                 save_time: int):
+                 save_time: int, entry_z: float = 1.1, exit_z: float = 0.9, bake_sleep_time: int = 4 * 60 * 60):
         super(Pairs, self).__init__(path=os.path.join(path, f'{pair_a}_{pair_b}_strategy'))
         self.pair_a = pair_a
         self.pair_b = pair_b
@@ -50,11 +70,15 @@ class Pairs(Stateful):
         self.th = th
         self.sleep_time = sleep_time
         self.save_time = save_time
-        self.volume_b = round(volume, 8)
+        self.save_every = max(1, save_time // sleep_time)
+        self.entry_z = entry_z
+        self.exit_z = exit_z
+        self.bake_sleep_time = bake_sleep_time
+        self.lots_b = self.trader.to_lots(volume)
         try:
             state = self.load_state()
             self.counter = state['counter']
-            self.position = state['invested']
+            self.position = Position(state['invested'])
         except FileNotFoundError:
             logger.debug("Initialising state with defaults...")
             self.counter = 0
@@ -71,61 +95,67 @@ class Pairs(Stateful):
         self.counter += 1
         sleep_time = self.sleep_time
 
-        ticker_a, ticker_b = (self.trader.get_ticker(x)[x] for x in (self.pair_a, self.pair_b))
+        tickers = self.trader.get_tickers(self.pair_a, self.pair_b)
+        ticker_a, ticker_b = tickers[self.pair_a], tickers[self.pair_b]
         price_a, price_b = (self.trader.mid_price(ticker) for ticker in (ticker_a, ticker_b))
-        logger.debug(f"{self.pair_a}: {price_a:.2f}, {self.pair_b}: {price_b:.2f}")
+        logger.debug("%s: %.2f, %s: %.2f", self.pair_a, price_a, self.pair_b, price_b)
         e, q, t = self.model(price_a, price_b)
-        logger.debug(f"error: ${e:.4f}, var: $${q:.4f}, b_weight:{t:.4f}")
+        logger.debug("error: $%.4f, var: $$%.4f, b_weight:%.4f", e, q, t)
+        sq = math.sqrt(q)
 
         if self.counter > self.bake_count:
             old_position = self.position
 
-            if self.position == Position.NOT_INVESTED:
-                if e < - 1.1 * np.sqrt(q):
-                    logger.info(f"Going long: ${e:.2f} < - ${1.1 * np.sqrt(q):.2f}")
-                    volume_a = round(self.volume_b * t, 8)
-                    self.trader.go_long(self.counter, volume_a, self.volume_b, price_a, price_b, self.th)
+            if self.position is Position.NOT_INVESTED:
+                entry = self.entry_z * sq
+                if e < - entry:
+                    logger.info(f"Going long: ${e:.2f} < - ${entry:.2f}")
+                    lots_a = round(self.lots_b * t)
+                    self.trader.go_long(self.counter, lots_a, self.lots_b, price_a, price_b, self.th)
                     self.position = Position.LONG
-                elif e > 1.1 * np.sqrt(q):
-                    logger.info(f"Going short: {e:.2f} > {1.1 * np.sqrt(q):.2f}")
-                    volume_a = round(self.volume_b * t, 8)
-                    self.trader.go_short(self.counter, volume_a, self.volume_b, price_a, price_b, self.th)
+                elif e > entry:
+                    logger.info(f"Going short: {e:.2f} > {entry:.2f}")
+                    lots_a = round(self.lots_b * t)
+                    self.trader.go_short(self.counter, lots_a, self.lots_b, price_a, price_b, self.th)
                     self.position = Position.SHORT
                 else:
-                    logger.debug(f"Abstaining")
-            elif self.position == Position.LONG:
-                if e > - 0.9 * np.sqrt(q):
-                    logger.info(f"Closing long: {e:.2f} > - {0.9 * np.sqrt(q):.2f}")
+                    logger.debug("Abstaining")
+            elif self.position is Position.LONG:
+                exit_ = self.exit_z * sq
+                if e > - exit_:
+                    logger.info(f"Closing long: {e:.2f} > - {exit_:.2f}")
                     p, r = self.trader.close_long(self.counter, price_a, price_b, self.th)
                     logger.info(f"Profit: ${p:.2f}")
                     logger.info(f"Return: {r * 100:.2f}%")
                     self.position = Position.NOT_INVESTED
                 else:
-                    logger.debug(f"Staying long")
-            elif self.position == Position.SHORT:
-                if e < 0.9 * np.sqrt(q):
-                    logger.info(f"Closing short: {e:.2f} < {0.9 * np.sqrt(q):.2f}")
+                    logger.debug("Staying long")
+            elif self.position is Position.SHORT:
+                exit_ = self.exit_z * sq
+                if e < exit_:
+                    logger.info(f"Closing short: {e:.2f} < {exit_:.2f}")
                     p, r = self.trader.close_short(self.counter, price_a, price_b, self.th)
                     logger.info(f"Profit: ${p:.2f}")
                     logger.info(f"Return: {r * 100:.2f}%")
                     self.position = Position.NOT_INVESTED
                 else:
-                    logger.debug(f"Staying short")
+                    logger.debug("Staying short")
 
-            if old_position != self.position or self.counter % (self.save_time / self.sleep_time) == 0:
+            if old_position is not self.position or self.counter % self.save_every == 0:
                 self.model.save_state()
+                self.save_state()
         else:
-            logger.debug(f"Incrementing bake count: {self.counter}")
+            logger.debug("Incrementing bake count: %d", self.counter)
             self.model.save_state()
-            sleep_time = 4 * 60 * 60
-
-        self.save_state()
+            self.save_state()
+            sleep_time = self.bake_sleep_time
 
-        logger.debug(f"Returning sleep time: {sleep_time} seconds")
+        logger.debug("Returning sleep time: %d seconds", sleep_time)
         return sleep_time
 
 
 if __name__ == '__main__':
+    _install_slack_handlers(logger)
     signal(SIGINT, signal_handler)
 
     parser = ArgumentParser()
@@ -137,10 +167,14 @@ if __name__ == '__main__':
     parser.add_argument("-th", "--threshold", help="limit order threshold", type=float, required=False, default=0.01)
     parser.add_argument("-st", "--sleep-time", help="sleep time in seconds", type=int, required=False, default=30)
     parser.add_argument("-svt", "--save-time", help="max time before save", type=int, required=False, default=46800)
+    parser.add_argument("-ez", "--entry-z", help="entry threshold in std devs", type=float, required=False, default=1.1)
+    parser.add_argument("-xz", "--exit-z", help="exit threshold in std devs", type=float, required=False, default=0.9)
+    parser.add_argument("-bst", "--bake-sleep-time", help="bake sleep time in seconds", type=int, required=False,
+                        default=4 * 60 * 60)
     args = parser.parse_args()
 
     strategy = Pairs(args.pair_a, args.pair_b, args.path, args.bake_count, args.volume, args.threshold, args.sleep_time,
-                     args.save_time)
+                     args.save_time, args.entry_z, args.exit_z, args.bake_sleep_time)
     while True:
         st = strategy()
         sleep(st)
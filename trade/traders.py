@@ -1,5 +1,8 @@
+import zlib
 from abc import ABC
 from logging import getLogger, DEBUG
+from math import fsum
+from operator import itemgetter
 
 from krakenex import API
 
@@ -18,6 +21,10 @@ class BaseTrader(ABC):
         r = self.client.query_public('Ticker', data=dict(pair=pair))
         return self._handle_request(r)
 
+    def get_tickers(self, *pairs: str):
+        r = self.client.query_public('Ticker', data=dict(pair=','.join(pairs)))
+        return self._handle_request(r)
+
     @staticmethod
     def mid_price(ticker) -> float:
         return round(0.5 * (float(ticker['a'][0]) + float(ticker['b'][0])), 4)
@@ -34,6 +41,14 @@ class BaseTrader(ABC):
         r = self.client.query_private('QueryTrades', data={**dict(txid=txid), **kwargs})
         return self._handle_request(r)
 
+    def query_trades(self, txids, **kwargs):
+        # QueryTrades takes up to 20 comma-separated txids per request
+        txids = list(dict.fromkeys(txids))
+        result = {}
+        for i in range(0, len(txids), 20):
+            result.update(self.query_trade(txid=','.join(txids[i:i + 20]), **kwargs))
+        return result
+
     @staticmethod
     def _handle_request(r):
         if r['error']:
@@ -47,33 +62,54 @@ class PairsTrader(BaseTrader):
         super(PairsTrader, self).__init__()
         self.pair_a = pair_a
         self.pair_b = pair_b
-        self.id = abs(hash(f"{pair_a}{pair_b}")) % (10 ** 6)
+        # crc32 is stable across processes, unlike the salted str hash
+        self.id = zlib.crc32(f"{pair_a}{pair_b}".encode('ascii')) % (10 ** 6)
+        # Volumes are handled as integer lots and prices as integer ticks, formatted only when sent to Kraken
+        self._lot_decimals = 8
+        self._lot_scale = 10 ** self._lot_decimals
+        self._price_decimals = 4
+        self._price_scale = 10 ** self._price_decimals
+
+    def to_lots(self, volume: float) -> int:
+        return int(round(volume * self._lot_scale))
+
+    def _format_lots(self, lots: int) -> str:
+        return self._format_fixed(lots, self._lot_decimals)
 
-    def _ez_limit_order(self, order_type: str, pair: str, userref: int, limit_price: float, volume: float, th: float,
+    def _format_price(self, price: float) -> str:
+        return self._format_fixed(int(round(price * self._price_scale)), self._price_decimals)
+
+    @staticmethod
+    def _format_fixed(units: int, decimals: int) -> str:
+        whole, frac = divmod(abs(units), 10 ** decimals)
+        return f"{'-' if units < 0 else ''}{whole}.{frac:0{decimals}d}"
+
+    def _ez_limit_order(self, order_type: str, pair: str, userref: int, limit_price: float, lots: int, th: float,
                         leverage: int = None):
         assert 0 < th < 1, "Factor of safety must be between 0-1"
-        th = (1 + th) if order_type == 'buy' else (1 - th)
+        sign = 1.0 if order_type == 'buy' else -1.0
+        th = 1.0 + sign * th
         data = dict(
             userref=userref,
             ordertype='limit',
             type=order_type,
-            volume=round(volume, 8),
+            volume=self._format_lots(lots),
             pair=pair,
-            price=round(th * limit_price, 4),
+            price=self._format_price(th * limit_price),
             timeinforce="IOC",
             leverage=leverage,
         )
-        logger.debug(f"Adding order with data: {data}")
+        logger.debug("Adding order with data: %s", data)
         r = self.client.query_private('AddOrder', data=data)
         r = self._handle_request(r)
 
-        logger.debug(f"{r['descr']['order']}")
+        logger.debug("%s", r['descr']['order'])
 
         orders = []
         for o_id in r['txid']:
             o = self.query_order(txid=o_id, userref=userref, trades=True)
             orders.append(o)
-            logger.debug(f"Verifying order close: {o}")
+            logger.debug("Verifying order close: %s", o)
             status = o[o_id]['status']
             assert status == 'closed', f"[Trader] Order ({o_id}) not closed, status: {status}."
 
@@ -85,35 +121,40 @@ class PairsTrader(BaseTrader):
             for _, v in o.items():
                 trades.extend(v['trades'])
         # Get opening trades
-        trades = [self.query_trade(txid=t_id, trades=True)[t_id]['postxid'] for t_id in trades]
-        cost, net = 0, 0
-        for t_id in trades:
-            t = self.query_trade(txid=t_id, trades=True)
-            cost += float(t[t_id]['ccost'])
-            net += float(t[t_id]['net'])
+        t = self.query_trades(trades, trades=True)
+        trades = [t[t_id]['postxid'] for t_id in trades]
+        t = self.query_trades(trades, trades=True)
+        get = itemgetter('ccost', 'net')
+        fills = [get(t[t_id]) for t_id in trades]
+        cost = fsum(float(c) for c, _ in fills)
+        net = fsum(float(n) for _, n in fills)
 
         return net, net / cost
 
-    def go_long(self, counter: int, volume_a: float, volume_b: float, price_a: float, price_b: float, th: float):
-        ref = int(f"{self.id}{counter}")
+    def _userref(self, counter: int) -> int:
+        # Kraken userrefs are signed 32-bit ints: pair id in the high digits, counter (mod 1000) in the low ones
+        return self.id * 1000 + counter % 1000
+
+    def go_long(self, counter: int, lots_a: int, lots_b: int, price_a: float, price_b: float, th: float):
+        ref = self._userref(counter)
         try:
             r_a, o_a = self._ez_limit_order(order_type='sell', pair=self.pair_a, userref=ref, limit_price=price_a,
-                                            volume=volume_a, th=th, leverage=2)
+                                            lots=lots_a, th=th, leverage=2)
             r_b, o_b = self._ez_limit_order(order_type='buy', pair=self.pair_b, userref=ref, limit_price=price_b,
-                                            volume=volume_b, th=th, leverage=2)
+                                            lots=lots_b, th=th, leverage=2)
         except Exception as e:
             logger.error(f"Failed to open long positions: {e}")
             raise e
 
         return r_a, r_b, o_a, o_b
 
-    def go_short(self, counter: int, volume_a: float, volume_b: float, price_a: float, price_b: float, th: float):
-        ref = int(f"{self.id}{counter}")
+    def go_short(self, counter: int, lots_a: int, lots_b: int, price_a: float, price_b: float, th: float):
+        ref = self._userref(counter)
         try:
             r_a, o_a = self._ez_limit_order(order_type='buy', pair=self.pair_a, userref=ref, limit_price=price_a,
-                                            volume=volume_a, th=th, leverage=2)
+                                            lots=lots_a, th=th, leverage=2)
             r_b, o_b = self._ez_limit_order(order_type='sell', pair=self.pair_b, userref=ref, limit_price=price_b,
-                                            volume=volume_b, th=th, leverage=2)
+                                            lots=lots_b, th=th, leverage=2)
 
         except Exception as e:
             logger.error(f"Failed to open short positions: {e}")